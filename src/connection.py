@@ -1,7 +1,9 @@
+import csv
+import itertools
 import pathlib
-from typing import Optional
+from typing import Iterator, Optional
 
-import openpyxl
+import numpy as np
 import pandas as pd
 
 
@@ -18,33 +20,67 @@ class Connection:
         """
         self.origin = origin
         self.destination = destination
-        outward_journey.insert(
-            1, "best", outward_journey.iloc[:, 1:].min(axis="columns")
-        )
+        outward_journey.insert(1, "best", _best_prices(outward_journey))
         if inward_journey is not None:
-            inward_journey.insert(
-                1, "best", inward_journey.iloc[:, 1:].min(axis="columns")
-            )
+            inward_journey.insert(1, "best", _best_prices(inward_journey))
         self.outward_journey = outward_journey
         self.inward_journey = inward_journey
 
     def to_excel(self, path):
+        # only needed for excel output, keeps importing this module cheap
+        import openpyxl
+
         sheet_name = f"{self.origin} -> {self.destination}"
         path = pathlib.Path(path).resolve()
-        if not path.exists():
-            with pd.ExcelWriter(path, engine="openpyxl") as writer:
-                wb: openpyxl.Workbook = writer.book
-                wb.create_sheet(sheet_name)
-        with pd.ExcelWriter(
-            path, engine="openpyxl", mode="a", if_sheet_exists="overlay"
-        ) as writer:
-            self.outward_journey.to_excel(writer, sheet_name=sheet_name)
-            self.inward_journey.to_excel(
-                writer,
-                sheet_name=sheet_name,
-                startcol=self.outward_journey.shape[1] + 1,
+        # replace an existing sheet at its current position, new sheets go last
+        index = None
+        if path.exists():
+            # write-only workbooks cannot be appended to, keep the other sheets intact
+            wb = openpyxl.load_workbook(path)
+            if sheet_name in wb.sheetnames:
+                index = wb.sheetnames.index(sheet_name)
+                del wb[sheet_name]
+        else:
+            wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(sheet_name, index)
+        for row in self._sheet_rows():
+            ws.append(row)
+        wb.save(path)
+
+    def to_csv(self, path):
+        """Write the same layout as 'to_excel' to a csv file."""
+        path = pathlib.Path(path).resolve()
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            csv.writer(file).writerows(self._sheet_rows())
+
+    def _sheet_rows(self) -> Iterator[tuple]:
+        """Rows of the outward (and inward) journey side by side, each with index and header."""
+        journeys = [self.outward_journey]
+        if self.return_trip:
+            journeys.append(self.inward_journey)
+        # padding for journeys that ran out of rows: index column + data columns
+        paddings = [(None,) * (journey.shape[1] + 1) for journey in journeys]
+        for parts in itertools.zip_longest(*map(_frame_rows, journeys)):
+            yield tuple(
+                value
+                for part, padding in zip(parts, paddings)
+                for value in (padding if part is None else part)
             )
 
     @property
     def return_trip(self):
         return self.inward_journey is not None
+
+
+def _best_prices(journey: pd.DataFrame) -> np.ndarray:
+    """Row-wise minimum of the price columns (everything after 'date')."""
+    prices = journey.iloc[:, 1:].to_numpy(dtype=float)
+    # unlike np.nanmin, fmin returns NaN for all-NaN rows without a RuntimeWarning
+    return np.fmin.reduce(prices, axis=1)
+
+
+def _frame_rows(frame: pd.DataFrame) -> Iterator[tuple]:
+    """Header and data rows of 'frame' as written by DataFrame.to_excel (index first)."""
+    yield None, *frame.columns
+    for index, row in zip(frame.index, frame.itertuples(index=False, name=None)):
+        yield index, *(None if pd.isna(value) else value for value in row)
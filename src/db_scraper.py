@@ -1,23 +1,83 @@
 import datetime as dt
-import locale
 import logging
 import os.path
 import pathlib
-from time import sleep
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
 
-import bs4
+import numpy as np
 import pandas as pd
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import StaleElementReferenceException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 
 from src.connection import Connection
-from src.xpath_soup import xpath_soup
 
 logger = logging.getLogger(__name__)
 
+# template profile holding the extensions, every browser runs on its own copy of it
+PROFILE_DIR = pathlib.Path(f"{__file__}/../../profile").resolve()
+# lists the extensions already installed into PROFILE_DIR
+INSTALLED_EXTENSIONS_FILE = "installed_extensions.txt"
+# cookies and web storage (e.g. the date position), not copied into a browser's profile
+_SITE_DATA = (
+    "storage",
+    "cookies.sqlite*",
+    "webappsstore.sqlite*",
+    "sessionstore.jsonlz4",
+    "sessionstore-backups",
+)
+_LOCK_FILES = ("lock", "parent.lock", ".parentlock")
+
+# seconds to wait for an element before giving up
+WAIT_TIMEOUT = 20
+
+# english month abbreviations as shown on the page, avoids switching the process locale
+_MONTHS = {
+    month: number
+    for number, month in enumerate(
+        "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), start=1
+    )
+}
+
+# amount following the euro sign of a price button, e.g. 'from €19.99' or '€1,019.99'
+_PRICE_RE = re.compile(r"€\s*(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)(?![\d,.])")
+
+# text of all price buttons of the current result page, in a single round trip
+_GET_PRICES_JS = """
+return Array.from(
+    document.querySelectorAll("span.tagesbestpreis-intervall__button-text"),
+    (e) => e.textContent
+);
+"""
+# displayed date of the current result page, null while it is not rendered
+_GET_DATE_JS = """
+return document.querySelector("div.db-web-date-scroller__date")?.textContent;
+"""
+
+PRICE_COLUMNS = ("00-07", "07-10", "10-13", "13-16", "16-19", "19-24")
+
+
+def _to_frame(conn: list[tuple[dt.date, list[float]]]) -> pd.DataFrame:
+    """Build the journey frame column-wise, so the prices end up in a single float64 block."""
+    dates = [c[0] for c in conn]
+    prices = np.array([c[1] for c in conn], dtype=np.float64).reshape(
+        len(conn), len(PRICE_COLUMNS)
+    )
+    return pd.DataFrame(
+        {"date": dates, **{col: prices[:, i] for i, col in enumerate(PRICE_COLUMNS)}}
+    )
+
 
 class DBScraper:
+    # set once the template profile holds every extension, checked once per process
+    _profile_ready = False
+
     def __init__(self, *, headless: bool = True, context_manager: bool = True):
         """
         A Scraper to fetch best prices for a connection from https://int.bahn.de/en
@@ -32,23 +92,58 @@ class DBScraper:
         :param context_manager: pass 'False' to use outside a context_manager.
             This will not automatically close the driver. Call 'close()' instead.
         """
+        self.headless = headless
         self.driver = None
+        self._profile_dir: Optional[pathlib.Path] = None
+        # second browser for return trips, kept alive across queries
+        self._return_driver = None
+        self._return_profile_dir: Optional[pathlib.Path] = None
         if not context_manager:
-            self.driver = self.setup_driver(headless)
-        self.headless = headless
+            self.driver, self._profile_dir = self._start_driver()
 
     def __enter__(self):
-        self.driver = self.setup_driver(self.headless)
+        self.driver, self._profile_dir = self._start_driver()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
     def close(self):
-        self.driver.close()
+        try:
+            # quit instead of close, the browser has to release its profile copy
+            self.driver.quit()
+        finally:
+            shutil.rmtree(self._profile_dir, ignore_errors=True)
+            self._close_return_driver()
+
+    def _start_driver(self):
+        """Start a browser on a fresh copy of the template profile."""
+        self._prepare_profile(self.headless)
+        # a running Firefox locks its profile, so every browser gets its own copy
+        profile_dir = pathlib.Path(tempfile.mkdtemp(prefix="db_scraper_"))
+        try:
+            _clone_profile(profile_dir)
+            driver = self.setup_driver(self.headless, profile_dir)
+        except BaseException:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        return driver, profile_dir
+
+    def _get_return_driver(self):
+        if not self._return_driver:
+            self._return_driver, self._return_profile_dir = self._start_driver()
+        return self._return_driver
+
+    def _close_return_driver(self):
+        if self._return_driver:
+            self._return_driver.quit()
+            self._return_driver = None
+        if self._return_profile_dir:
+            shutil.rmtree(self._return_profile_dir, ignore_errors=True)
+            self._return_profile_dir = None
 
     @staticmethod
-    def setup_driver(headless: bool):
+    def setup_driver(headless: bool, profile_dir: pathlib.Path):
         logger.info("Initializing webdriver.")
         options = webdriver.FirefoxOptions()
         options.binary_location = str(
@@ -56,6 +151,9 @@ class DBScraper:
         )
         if headless:
             options.add_argument("-headless")
+        # run on the given directory itself, so extensions installed into it persist
+        options.add_argument("-profile")
+        options.add_argument(str(profile_dir))
 
         service = webdriver.FirefoxService(
             executable_path=str(
@@ -63,15 +161,58 @@ class DBScraper:
             )
         )
 
-        driver = webdriver.Firefox(options=options, service=service)
-
+        return webdriver.Firefox(options=options, service=service)
+
+    @classmethod
+    def _prepare_profile(cls, headless: bool):
+        """Install extensions missing from the template profile."""
+        if cls._profile_ready:
+            return
+        PROFILE_DIR.mkdir(exist_ok=True)
+        marker = PROFILE_DIR / INSTALLED_EXTENSIONS_FILE
+        installed = set(marker.read_text().splitlines()) if marker.exists() else set()
+        missing = []
         for extension in pathlib.Path(f"{__file__}/../../extensions/").iterdir():
             file_name, file_ext = os.path.splitext(extension)
-            if file_ext == ".xpi":
-                driver.install_addon(str(extension))
+            if file_ext == ".xpi" and extension.name not in installed:
+                missing.append(extension)
+
+        if missing:
+            if _profile_in_use(PROFILE_DIR):
+                raise DriverError(
+                    f"Profile '{PROFILE_DIR}' is locked by another Firefox instance. "
+                    "Close it or delete the lock file if no Firefox is running."
+                )
+            driver = cls.setup_driver(headless, PROFILE_DIR)
+            try:
+                for extension in missing:
+                    logger.info(
+                        f"Installing extension {extension.name} into the profile."
+                    )
+                    driver.install_addon(str(extension))
+                    installed.add(extension.name)
+            finally:
+                driver.quit()
+                marker.write_text("\n".join(sorted(installed)))
+
+        cls._profile_ready = True
+
+    def reset_session(self, driver=None):
+        """Clear cookies and web storage of the current site without restarting the browser."""
+        driver = driver or self.driver
+        driver.delete_all_cookies()
+        driver.execute_script(
+            "window.localStorage.clear(); window.sessionStorage.clear();"
+        )
 
-        driver.implicitly_wait(20)
-        return driver
+    @staticmethod
+    def _wait(driver, condition, timeout: float = WAIT_TIMEOUT):
+        """Block until 'condition' (an expected condition) is met and return its result."""
+        return WebDriverWait(
+            driver,
+            timeout,
+            ignored_exceptions=(StaleElementReferenceException,),
+        ).until(condition)
 
     def get_connection(
         self, origin: str, destination: str, days: int, return_trip: bool = True
@@ -83,127 +224,209 @@ class DBScraper:
                 "Note that use outside of a context manager will not automatically close the driver instance."
             )
 
-        columns = ("date", "00-07", "07-10", "10-13", "13-16", "16-19", "19-24")
-
-        conn: list[tuple[dt.date, list[float]]] = self._get_connection(
-            origin, destination, days
-        )
         if return_trip:
-            # seems like the simplest way to reset the local storage (gets rid of date position)
-            self.driver.close()
-            self.driver = self.setup_driver(headless=self.headless)
-            return_conn: list[tuple[dt.date, list[float]]] = self._get_connection(
-                destination, origin, days
-            )
-            inward_journey = pd.DataFrame(
-                [[c[0], *c[1]] for c in return_conn], columns=columns
-            )
+            # both directions are independent, query them side by side in a second browser
+            executor = ThreadPoolExecutor(max_workers=2)
+            try:
+                return_driver = self._get_return_driver()
+                outward = executor.submit(
+                    self._get_connection, self.driver, origin, destination, days
+                )
+                inward = executor.submit(
+                    self._get_connection, return_driver, destination, origin, days
+                )
+                conn: list[tuple[dt.date, list[float]]] = outward.result()
+                return_conn: list[tuple[dt.date, list[float]]] = inward.result()
+            except BaseException:
+                # don't wait for the return trip to run into its timeouts, quitting its
+                # browser makes the query fail fast and it won't be reused anyway
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._close_return_driver()
+                raise
+            executor.shutdown()
+            inward_journey = _to_frame(return_conn)
         else:
+            conn = self._get_connection(self.driver, origin, destination, days)
             inward_journey = None
 
-        outward_journey = pd.DataFrame([[c[0], *c[1]] for c in conn], columns=columns)
+        outward_journey = _to_frame(conn)
 
         return Connection(origin, destination, outward_journey, inward_journey)
 
+    def get_connections(
+        self, pairs: Iterable[tuple[str, str, int, bool]]
+    ) -> list[Connection]:
+        """
+        Query several connections, reusing the running browsers for all of them.
+
+        :param pairs: (origin, destination, days, return_trip) for every connection
+        """
+        return [
+            self.get_connection(origin, destination, days, return_trip)
+            for origin, destination, days, return_trip in pairs
+        ]
+
     def _get_connection(
-        self, origin: str, destination: str, days: int
+        self, driver, origin: str, destination: str, days: int
     ) -> list[tuple[dt.date, list[float]]]:
         logger.info(f"Querying connection. ({origin} --> {destination}; days: {days})")
 
-        self.initial_search(origin, destination)
-        sleep(1)
-        best_prices: list[tuple[dt.date, list[float]]] = []
-        for i in range(1, days + 1):
-            # this makes sure we wait until the page is fully loaded, the element itself is not relevant
-            try:
-                _ = self.driver.find_element(
-                    By.CSS_SELECTOR, ".tagesbestpreis-intervall--selected"
+        try:
+            self.initial_search(origin, destination, driver)
+            best_prices: list[tuple[dt.date, list[float]]] = []
+            for i in range(1, days + 1):
+                # this makes sure we wait until the page is fully loaded, the element itself is not relevant
+                self._wait(
+                    driver,
+                    EC.presence_of_element_located(
+                        (By.CSS_SELECTOR, ".tagesbestpreis-intervall--selected")
+                    ),
                 )
-            except NoSuchElementException:
-                # hope the page will load if we wait a bit longer
-                sleep(15)
 
-            sleep(.5)
+                logger.info(
+                    f"Retrieving price data {i}/{days} ({origin} --> {destination})"
+                )
 
-            logger.info(f"Retrieving price data {i}/{days}")
+                if i == 1:
+                    # every click moves one day ahead, so only the first date has to be read
+                    current_date = self._wait(driver, self.get_date)
 
-            best_prices.append(self.get_prices(self.driver.page_source))
-            next_page_btn = self.driver.find_element(
-                By.CSS_SELECTOR, "span.icon-next2:nth-child(2)"
-            )
-            if i < days:
-                # No need to load the next page for the last day.
-                next_page_btn.click()
-
-        return best_prices
+                best_prices.append(
+                    (current_date, self.get_prices(driver, current_date))
+                )
+                if i < days:
+                    # No need to load the next page for the last day.
+                    current_date += dt.timedelta(days=1)
+                    old_price_btn = driver.find_element(
+                        By.CSS_SELECTOR, "span.tagesbestpreis-intervall__button-text"
+                    )
+                    self._wait(
+                        driver,
+                        EC.element_to_be_clickable(
+                            (By.CSS_SELECTOR, "span.icon-next2:nth-child(2)")
+                        ),
+                    ).click()
+                    # the date scroller updates before the prices, wait for both
+                    self._wait(driver, lambda d: self.get_date(d) == current_date)
+                    self._wait(driver, EC.staleness_of(old_price_btn))
+            return best_prices
+        finally:
+            # gets rid of the date position, so the next query starts at today again,
+            # also after a failed query
+            try:
+                self.reset_session(driver)
+            except Exception:
+                logger.warning("Could not reset the browser session.", exc_info=True)
 
     @staticmethod
-    def get_prices(page) -> tuple[dt.date, list[float]]:
-        soup = bs4.BeautifulSoup(page, features="lxml")
-
-        price_btns = soup.find_all(
-            "span", class_="tagesbestpreis-intervall__button-text"
-        )
-        price_strs = [price_btn.text for price_btn in price_btns]
-        prices = [float(price.split("€")[-1]) for price in price_strs]
+    def get_prices(driver, date: Optional[dt.date] = None) -> list[float]:
+        price_texts = driver.execute_script(_GET_PRICES_JS)
+        if len(price_texts) != len(PRICE_COLUMNS):
+            raise PriceError(
+                f"Expected {len(PRICE_COLUMNS)} price buttons on {date}, "
+                f"found {len(price_texts)}: {price_texts}"
+            )
+        prices = []
+        for price_text in price_texts:
+            amounts = _PRICE_RE.findall(price_text)
+            if not amounts:
+                raise PriceError(f"No price found on {date} in {price_text!r}")
+            # as before, the last amount on a button is its price
+            prices.append(float(amounts[-1].replace(",", "")))
+        return prices
 
-        date_str = soup.find("div", class_="db-web-date-scroller__date").text
+    @staticmethod
+    def get_date(driver) -> Optional[dt.date]:
+        date_str = (driver.execute_script(_GET_DATE_JS) or "").strip()
+        if not date_str:
+            return None
         day, month, year = date_str.split()[1:]
-        day = f"{day.strip('.'):0>2}"
-
-        locale.setlocale(locale.LC_ALL, "en_US")
-        date = dt.datetime.strptime(f"{day} {month} {year}", r"%d %b %Y").date()
-        locale.setlocale(locale.LC_ALL, "")
-
-        return date, prices
+        return dt.date(int(year), _MONTHS[month[:3]], int(day.strip(".")))
 
-    def initial_search(self, origin, destination):
-        self.driver.get("https://int.bahn.de/en/")
-        origin_input = self.driver.find_element(By.NAME, "quickFinderBasic-von")
-        dest_input = self.driver.find_element(By.NAME, "quickFinderBasic-nach")
+    def initial_search(self, origin, destination, driver=None):
+        driver = driver or self.driver
+        driver.get("https://int.bahn.de/en/")
+        origin_input = self._wait(
+            driver, EC.presence_of_element_located((By.NAME, "quickFinderBasic-von"))
+        )
+        dest_input = driver.find_element(By.NAME, "quickFinderBasic-nach")
 
         origin_input.send_keys(origin)
         dest_input.send_keys(destination)
 
-        time_selector = self.driver.find_element(
+        time_selector = driver.find_element(
             By.CLASS_NAME, "quick-finder-option-area__heading"
         )
         time_selector.click()
-        sleep(0.5)
-
-        soup: bs4.BeautifulSoup = bs4.BeautifulSoup(
-            self.driver.page_source, features="lxml"
+        # the day after today, located directly with the adjacent sibling combinator
+        next_day = self._wait(
+            driver,
+            EC.element_to_be_clickable(
+                (
+                    By.CSS_SELECTOR,
+                    ".db-web-date-picker-calendar-day--selected-date.db-web-date-picker-calendar-day--current-date"
+                    " + .db-web-date-picker-calendar-day",
+                )
+            ),
         )
+        next_day.click()
 
-        current_day = soup.find(
-            "div",
-            class_="db-web-date-picker-calendar-day db-web-date-picker-calendar-day--day-in-month-or-selectable "
-            "db-web-date-picker-calendar-day--selected-date db-web-date-picker-calendar-day--current-date",
+        accept_btn = self._wait(
+            driver, EC.element_to_be_clickable((By.CSS_SELECTOR, "._button"))
         )
-        next_day = current_day.next_sibling
-        self.driver.find_element(By.XPATH, xpath_soup(next_day)).click()  # noqa
-
-        accept_btn = self.driver.find_element(By.CSS_SELECTOR, "._button")
         accept_btn.click()
 
-        search_btn = self.driver.find_element(
-            By.CSS_SELECTOR,
-            r"button.db-web-button:nth-child(3) > span:nth-child(1) > span:nth-child(1)",
+        search_btn = self._wait(
+            driver,
+            EC.element_to_be_clickable(
+                (
+                    By.CSS_SELECTOR,
+                    r"button.db-web-button:nth-child(3) > span:nth-child(1) > span:nth-child(1)",
+                )
+            ),
         )
-
         search_btn.click()
-        sleep(3)
 
-        self.driver.find_element(
-            By.CSS_SELECTOR,
-            ".db-web-switch-list__button-container--align-top > span:nth-child(2)",
+        self._wait(
+            driver,
+            EC.element_to_be_clickable(
+                (
+                    By.CSS_SELECTOR,
+                    ".db-web-switch-list__button-container--align-top > span:nth-child(2)",
+                )
+            ),
         ).click()
-        sleep(3)
+
+
+def _profile_in_use(profile_dir: pathlib.Path) -> bool:
+    # the 'lock' symlink only exists while Firefox runs, a held parent lock can't be removed
+    if os.path.lexists(profile_dir / "lock"):
+        return True
+    for name in ("parent.lock", ".parentlock"):
+        try:
+            (profile_dir / name).unlink(missing_ok=True)
+        except OSError:
+            return True
+    return False
+
+
+def _clone_profile(target: pathlib.Path):
+    """Copy the template profile without site data or lock files."""
+    shutil.copytree(
+        PROFILE_DIR,
+        target,
+        ignore=shutil.ignore_patterns(*_SITE_DATA, *_LOCK_FILES),
+        dirs_exist_ok=True,
+    )
 
 
 class DriverError(Exception):
     """Invalid or missing driver object."""
 
 
+class PriceError(Exception):
+    """Price data on the result page could not be read."""
+
+
 if __name__ == "__main__":
     pass